@@ -1,30 +1,73 @@
 import os
 import asyncio
-from typing import Dict, Any, List, Optional, TypedDict, Annotated
-from datetime import datetime
+import inspect
+from typing import Dict, Any, List, Optional, Tuple, TypedDict, Annotated, Callable
+from datetime import datetime, timezone
 
 from langgraph.graph import StateGraph, END, START
 from langgraph.graph.message import add_messages
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langgraph.types import CachePolicy
+from langgraph.cache.memory import InMemoryCache
+from langchain_core.messages import HumanMessage, AIMessage
 from langchain_openai import ChatOpenAI
 from langchain_core.tools import tool
 from pydantic import BaseModel
 import httpx
 import logging
+import logging.handlers
+import queue
+import re
+import cachetools
+
+try:
+    import ahocorasick
+except ImportError:  # optional accelerator; fall back to a compiled regex
+    ahocorasick = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def setup_queue_logging() -> logging.handlers.QueueListener:
+    """Route root logging through a queue so stderr writes happen off the event loop thread.
+    
+    Meant for entry points; importing this module leaves the host's logging setup alone.
+    """
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[logging.handlers.QueueHandler(log_queue)],
+        force=True
+    )
+    listener.start()
+    return listener
+
+# Phrases in user input that suggest Adam should consult his knowledge
+KNOWLEDGE_INDICATORS = (
+    "what is", "who is", "tell me about", "explain", "define",
+    "how does", "why does", "when did", "where is", "history of",
+    "information about", "facts about", "details about",
+    "magic", "northern isles", "wisdom", "time", "gaming"
+)
+_MIN_INDICATOR_LENGTH = min(len(indicator) for indicator in KNOWLEDGE_INDICATORS)
+_KW_RE = re.compile("|".join(map(re.escape, KNOWLEDGE_INDICATORS)), re.IGNORECASE)
+
+# Chit-chat that never warrants a knowledge lookup
+_GREETINGS = frozenset({"hi", "hello", "hey", "thanks", "thank you", "bye", "goodbye"})
+
 # State Management for Adam NPC Workflow
 class AdamWorkflowState(TypedDict):
     """State object for Adam NPC conversation workflow."""
     messages: Annotated[List[Dict[str, Any]], add_messages]
     user_input: str
+    user_input_lc: str
+    turn_timestamp: str
     context_summary: str
     knowledge_used: bool
     knowledge_result: Optional[str]
-    needs_knowledge_search: bool
     adam_response: str
     conversation_metadata: Dict[str, Any]
 
@@ -38,11 +81,48 @@ class AdamNPCWorkflow:
             model="gpt-4o",
             api_key=openai_api_key,
             temperature=0.7,
-            max_tokens=300
+            max_tokens=300,
+            # Fail fast on connect and retry once, rather than the default two
+            # retries, to keep tail latency bounded
+            timeout=httpx.Timeout(30.0, connect=2.0),
+            max_retries=1
+        )
+        
+        # Shared HTTP client for all MCP calls (keep-alive connection reuse).
+        # httpx only negotiates HTTP/2 over TLS, so plain-http servers such
+        # as the local uvicorn instance stay on pooled HTTP/1.1 connections.
+        self._http = httpx.AsyncClient(
+            base_url=mcp_server_url,
+            http2=mcp_server_url.startswith("https://"),
+            timeout=httpx.Timeout(10.0),
+            limits=httpx.Limits(
+                max_keepalive_connections=32,
+                max_connections=64,
+                keepalive_expiry=60
+            )
         )
         
+        # Knowledge results keyed by normalized query, with per-key locks so
+        # concurrent identical queries share a single MCP round-trip
+        self._know_cache = cachetools.TTLCache(maxsize=256, ttl=600)
+        self._know_inflight: Dict[str, asyncio.Task] = {}
+        
+        # Background context updates still in flight
+        self._pending_tasks: set = set()
+        
+        # Bumped whenever the MCP context changes; keys the context cache
+        self._context_version = 0
+        
+        # Knowledge indicator automaton (single pass over the user input)
+        self._kw_automaton = None
+        if ahocorasick is not None:
+            self._kw_automaton = ahocorasick.Automaton()
+            for keyword in KNOWLEDGE_INDICATORS:
+                self._kw_automaton.add_word(keyword.lower(), keyword)
+            self._kw_automaton.make_automaton()
+        
         # Adam's system prompt
-        self.adam_system_prompt = """You are Adam, a wise and ancient sage who has lived for centuries in the mystical Northern Isles. 
+        self.adam_system_prompt = inspect.cleandoc("""You are Adam, a wise and ancient sage who has lived for centuries in the mystical Northern Isles. 
         You possess vast knowledge of magic, philosophy, and the arcane arts. 
         You speak with measured wisdom, often referencing your long life and experiences.
             Character traits:
@@ -52,7 +132,8 @@ class AdamNPCWorkflow:
             - Offer wisdom and guidance when appropriate
             - Maintain an air of mystery about your magical knowledge
 
-            When you have access to relevant knowledge from your search, incorporate it naturally into your response."""
+            When you have access to relevant knowledge from your search, incorporate it naturally into your response.""")
+        self._system_message = {"role": "system", "content": self.adam_system_prompt}
 
         # Build the workflow graph
         self.workflow = self._build_workflow()
@@ -64,229 +145,265 @@ class AdamNPCWorkflow:
         workflow = StateGraph(AdamWorkflowState)
         
         # Add nodes for each step in the dialogue process
-        workflow.add_node("input_processor", self._process_input)
-        workflow.add_node("context_retriever", self._retrieve_context)
-        workflow.add_node("knowledge_decider", self._decide_knowledge_search)
-        workflow.add_node("knowledge_searcher", self._search_knowledge)
+        workflow.add_node(
+            "context_retriever",
+            self._retrieve_context,
+            cache_policy=CachePolicy(key_func=lambda s: str(self._context_version), ttl=5)
+        )
+        workflow.add_node("knowledge_gate", self._gate_knowledge)
         workflow.add_node("response_generator", self._generate_response)
-        workflow.add_node("context_updater", self._update_context)
         
         # Define the workflow edges
-        workflow.add_edge(START, "input_processor")
-        workflow.add_edge("input_processor", "context_retriever")
-        workflow.add_edge("context_retriever", "knowledge_decider")
+        # Fan out from START: the user input is already in the initial state,
+        # so context retrieval and knowledge search start immediately
+        workflow.add_edge(START, "context_retriever")
+        workflow.add_edge(START, "knowledge_gate")
         
-        # Conditional edge for knowledge search
-        workflow.add_conditional_edges(
-            "knowledge_decider",
-            self._should_search_knowledge,
-            {
-                True: "knowledge_searcher",
-                False: "response_generator"
-            }
-        )
-        
-        workflow.add_edge("knowledge_searcher", "response_generator")
-        workflow.add_edge("response_generator", "context_updater")
-        workflow.add_edge("context_updater", END)
-        
-        return workflow.compile()
-    
-    # Process user input
-    async def _process_input(self, state: AdamWorkflowState) -> Dict[str, Any]:
-        """Process user input and prepare it for the workflow."""
-        logger.info(f"Processing user input: {state['user_input'][:50]}...")
-        
-        # Add user message to the conversation
-        user_message = HumanMessage(content=state["user_input"])
+        # Fan in: response generation waits for both branches
+        workflow.add_edge(["context_retriever", "knowledge_gate"], "response_generator")
+        workflow.add_edge("response_generator", END)
         
-        return {
-            "messages": [user_message],
-            "conversation_metadata": {
-                "timestamp": datetime.now().isoformat(),
-                "input_length": len(state["user_input"])
-            }
-        }
+        return workflow.compile(cache=InMemoryCache())
     
     # Helper function to retrieve conversation context
     async def _retrieve_context(self, state: AdamWorkflowState) -> Dict[str, Any]:
         """Retrieve conversation context from MCP server."""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.mcp_server_url}/get_context")
-                if response.status_code == 200:
-                    context_data = response.json()
-                    summary = context_data.get("summary", "No conversation history.")
-                    logger.info("Retrieved conversation context successfully")
-                    return {"context_summary": summary}
-                else:
-                    logger.warning(f"Failed to retrieve context: {response.status_code}")
-                    return {"context_summary": "No conversation history available."}
+            # Only the summary is used, so skip the raw message list
+            response = await self._http.get("/get_context", params={"limit": 0})
+            if response.status_code == 200:
+                context_data = response.json()
+                summary = context_data.get("summary", "No conversation history.")
+                logger.info("Retrieved conversation context successfully")
+                return {"context_summary": summary}
+            else:
+                logger.warning("Failed to retrieve context: %s", response.status_code)
+                return {"context_summary": "No conversation history available."}
         except Exception as e:
-            logger.error(f"Error retrieving context: {e}")
+            logger.error("Error retrieving context: %s", e)
             return {"context_summary": "Error accessing conversation history."}
     
     # Decide if knowledge search is needed
-    async def _decide_knowledge_search(self, state: AdamWorkflowState) -> Dict[str, Any]:
+    def _should_search_knowledge(self, state: AdamWorkflowState) -> bool:
         """Decide if knowledge search is needed based on user input."""
-        user_input = state["user_input"].lower()
+        # Inputs too short to contain an indicator, or plain greetings
+        if (len(state["user_input"]) < _MIN_INDICATOR_LENGTH
+                or state["user_input_lc"].strip(" .!?") in _GREETINGS):
+            return False
+        
+        # Stop at the first indicator found
+        if self._kw_automaton is not None:
+            return next(self._kw_automaton.iter(state["user_input_lc"]), None) is not None
+        return _KW_RE.search(state["user_input"]) is not None
+    
+    # Knowledge branch: decide and, if needed, search
+    async def _gate_knowledge(self, state: AdamWorkflowState) -> Dict[str, Any]:
+        """Run the knowledge search only when the user input calls for it."""
+        needs_search = self._should_search_knowledge(state)
+        logger.info("Knowledge search needed: %s", needs_search)
+        if not needs_search:
+            return {"knowledge_used": False, "knowledge_result": None}
         
-        # Knowledge indicators
-        knowledge_indicators = [
-            "what is", "who is", "tell me about", "explain", "define",
-            "how does", "why does", "when did", "where is", "history of",
-            "information about", "facts about", "details about",
-            "magic", "northern isles", "wisdom", "time", "gaming"
-        ]
+        return await self._search_knowledge(state)
+    
+    async def _search_knowledge(self, state: AdamWorkflowState) -> Dict[str, Any]:
+        """Search for knowledge, serving repeated queries from the local cache."""
+        key = " ".join(state["user_input_lc"].split())
+        cached = self._know_cache.get(key)
+        if cached is not None:
+            logger.info("Knowledge search served from cache")
+            return cached
         
-        needs_search = any(indicator in user_input for indicator in knowledge_indicators)
-        logger.info(f"Knowledge search needed: {needs_search}")
+        # Concurrent identical queries share one in-flight fetch and its outcome
+        task = self._know_inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_knowledge(state["user_input"]))
+            self._know_inflight[key] = task
+            task.add_done_callback(lambda t: self._knowledge_fetched(key, t))
         
-        return {"needs_knowledge_search": needs_search}
+        # Shield so one cancelled turn doesn't cancel the fetch for the others
+        result, _ = await asyncio.shield(task)
+        return result
     
-    # Conditional edge function to determine if knowledge search is needed
-    def _should_search_knowledge(self, state: AdamWorkflowState) -> bool:
-        """Conditional edge function to determine if knowledge search is needed."""
-        return state.get("needs_knowledge_search", False)
+    def _knowledge_fetched(self, key: str, task: asyncio.Task):
+        """Retire a finished knowledge fetch, caching results the server actually found."""
+        self._know_inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        result, found = task.result()
+        if found:
+            self._know_cache[key] = result
     
-    async def _search_knowledge(self, state: AdamWorkflowState) -> Dict[str, Any]:
-        """Search for knowledge using MCP server knowledge tool."""
+    async def _fetch_knowledge(self, query: str) -> Tuple[Dict[str, Any], bool]:
+        """Search for knowledge using MCP server knowledge tool.
+        
+        Returns the state update and whether the server found a real answer.
+        """
         try:
-            query_data = {"query": state["user_input"]}
+            query_data = {"query": query}
             
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.mcp_server_url}/knowledge_search",
-                    json=query_data
-                )
+            response = await self._http.post("/knowledge_search", json=query_data)
+            
+            if response.status_code == 200:
+                result_data = response.json()
+                knowledge_result = result_data.get("result", "No knowledge found.")
+                logger.info("Knowledge search completed successfully")
                 
-                if response.status_code == 200:
-                    result_data = response.json()
-                    knowledge_result = result_data.get("result", "No knowledge found.")
-                    logger.info("Knowledge search completed successfully")
-                    
-                    return {
-                        "knowledge_used": True,
-                        "knowledge_result": knowledge_result
-                    }
-                else:
-                    logger.warning(f"Knowledge search failed: {response.status_code}")
-                    return {
-                        "knowledge_used": False,
-                        "knowledge_result": None
-                    }
+                return {
+                    "knowledge_used": True,
+                    "knowledge_result": knowledge_result
+                }, result_data.get("found", True)
+            else:
+                logger.warning("Knowledge search failed: %s", response.status_code)
+                return {
+                    "knowledge_used": False,
+                    "knowledge_result": None
+                }, False
         except Exception as e:
-            logger.error(f"Error during knowledge search: {e}")
+            logger.error("Error during knowledge search: %s", e)
             return {
                 "knowledge_used": False,
                 "knowledge_result": None
-            }
+            }, False
     
     # Generate Adam's response
     async def _generate_response(self, state: AdamWorkflowState) -> Dict[str, Any]:
         """Generate Adam's response using OpenAI with context and knowledge."""
         try:
-            # Prepare the conversation messages
-            messages = [SystemMessage(content=self.adam_system_prompt)]
+            # Static persona prompt stays verbatim at position 0 so the
+            # provider's prompt-prefix cache can reuse it across turns
+            messages = [self._system_message]
             
-            # Add context if available
-            if state.get("context_summary"):
-                context_msg = SystemMessage(
-                    content=f"Conversation context: {state['context_summary']}"
-                )
-                messages.append(context_msg)
+            # Earlier conversation messages, if any
+            messages.extend(state["messages"][:-1])
             
-            # Add knowledge if available
+            # Per-turn context and knowledge go in one trailing system message
+            dynamic_parts = []
+            if state.get("context_summary"):
+                dynamic_parts.append(f"Conversation context: {state['context_summary']}")
             if state.get("knowledge_result"):
-                knowledge_msg = SystemMessage(
-                    content=f"Relevant knowledge: {state['knowledge_result']}"
-                )
-                messages.append(knowledge_msg)
+                dynamic_parts.append(f"Relevant knowledge: {state['knowledge_result']}")
+            if dynamic_parts:
+                messages.append({"role": "system", "content": "\n\n".join(dynamic_parts)})
             
-            # Add the current conversation messages
-            messages.extend(state["messages"])
+            # The current user turn
+            messages.extend(state["messages"][-1:])
             
-            # Generate response using OpenAI
-            response = await self.llm.ainvoke(messages)
-            adam_response = response.content
+            # Generate response using OpenAI, streaming tokens as they arrive
+            adam_response = ""
+            async for chunk in self.llm.astream(messages):
+                adam_response += chunk.content
             
             logger.info("Generated Adam's response successfully")
             
             return {"adam_response": adam_response}
             
         except Exception as e:
-            logger.error(f"Error generating response: {e}")
+            logger.error("Error generating response: %s", e)
             return {
                 "adam_response": "I apologize, but something went wrong while processing your message. Could you try again?"
             }
     
     # Update conversation context on MCP server
-    async def _update_context(self, state: AdamWorkflowState) -> Dict[str, Any]:
-        """Update conversation context on MCP server."""
+    async def _persist_turn(self, user_input: str, adam_response: str, turn_timestamp: str) -> bool:
+        """Store a finished dialogue turn in the MCP conversation context."""
         try:
-            # Add user message to context
             user_msg_data = {
                 "role": "user",
-                "content": state["user_input"],
-                "timestamp": datetime.now().isoformat()
+                "content": user_input,
+                "timestamp": turn_timestamp
             }
-            
-            async with httpx.AsyncClient() as client:
-                await client.post(
-                    f"{self.mcp_server_url}/add_message",
-                    json=user_msg_data
-                )
-            
-            # Add Adam's response to context
             adam_msg_data = {
                 "role": "assistant", 
-                "content": state["adam_response"],
-                "timestamp": datetime.now().isoformat()
+                "content": adam_response,
+                "timestamp": turn_timestamp
             }
             
-            async with httpx.AsyncClient() as client:
-                await client.post(
-                    f"{self.mcp_server_url}/add_message",
-                    json=adam_msg_data
-                )
+            # One batched request keeps the pair in order on the server
+            response = await self._http.post(
+                "/add_messages",
+                json={"messages": [user_msg_data, adam_msg_data]}
+            )
             
-            logger.info("Updated conversation context successfully")
+            if response.status_code != 200:
+                logger.warning("Failed to update context: %s", response.status_code)
+                return False
             
-            return {
-                "conversation_metadata": {
-                    **state.get("conversation_metadata", {}),
-                    "context_updated": True
-                }
-            }
+            self.invalidate_context_cache()
+            logger.info("Updated conversation context successfully")
+            return True
             
         except Exception as e:
-            logger.error(f"Error updating context: {e}")
-            return {
-                "conversation_metadata": {
-                    **state.get("conversation_metadata", {}),
-                    "context_updated": False
-                }
-            }
+            logger.error("Error updating context: %s", e)
+            return False
+    
+    async def flush_context_updates(self):
+        """Wait for background context updates to finish."""
+        if self._pending_tasks:
+            await asyncio.wait(set(self._pending_tasks))
+    
+    def invalidate_context_cache(self):
+        """Force the next turn to re-fetch context from the MCP server."""
+        self._context_version += 1
     
     # Process dialogue
-    async def process_dialogue(self, user_input: str) -> Dict[str, Any]:
-        """Process a dialogue turn through the LangGraph workflow."""
+    async def process_dialogue(
+        self,
+        user_input: str,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> Dict[str, Any]:
+        """Process a dialogue turn through the LangGraph workflow.
+        
+        If on_token is given, it is called with each token of Adam's
+        response as soon as the model produces it.
+        """
         
-        # Initial state
+        logger.info("Processing user input (%d chars)", len(user_input))
+        
+        # Let the previous turn's context update land before reading context
+        await self.flush_context_updates()
+        turn_timestamp = datetime.now(timezone.utc).isoformat()
+        
+        # Initial state; input processing happens here rather than in a
+        # graph node so both parallel branches can start at once
         initial_state = AdamWorkflowState(
-            messages=[],
+            messages=[HumanMessage(content=user_input)],
             user_input=user_input,
+            user_input_lc=user_input.lower(),
+            turn_timestamp=turn_timestamp,
             context_summary="",
             knowledge_used=False,
             knowledge_result=None,
-            needs_knowledge_search=False,
             adam_response="",
-            conversation_metadata={}
+            conversation_metadata={
+                "timestamp": turn_timestamp,
+                "input_length": len(user_input)
+            }
         )
         
         # Execute the workflow
         try:
-            result = await self.workflow.ainvoke(initial_state)
+            if on_token is None:
+                result = await self.workflow.ainvoke(initial_state)
+            else:
+                result = initial_state
+                async for mode, data in self.workflow.astream(
+                    initial_state, stream_mode=["messages", "values"]
+                ):
+                    if mode == "values":
+                        result = data
+                        continue
+                    chunk, metadata = data
+                    if metadata.get("langgraph_node") == "response_generator" and chunk.content:
+                        on_token(chunk.content)
+            
+            # Persist the turn in the background; the caller gets the
+            # response without waiting for the MCP write
+            task = asyncio.create_task(
+                self._persist_turn(user_input, result["adam_response"], turn_timestamp)
+            )
+            self._pending_tasks.add(task)
+            task.add_done_callback(self._pending_tasks.discard)
             
             return {
                 "response": result["adam_response"],
@@ -295,13 +412,20 @@ class AdamNPCWorkflow:
                 "metadata": result.get("conversation_metadata", {})
             }
         except Exception as e:
-            logger.error(f"Workflow execution error: {e}")
+            logger.error("Workflow execution error: %s", e)
             return {
                 "response": "I apologize, but something went wrong while processing your message. Could you try again?",
                 "used_knowledge_tool": False,
                 "knowledge_result": None,
                 "metadata": {"error": str(e)}
             }
+    
+    async def aclose(self):
+        """Flush pending context updates and knowledge fetches, then close the shared HTTP client."""
+        await self.flush_context_updates()
+        if self._know_inflight:
+            await asyncio.gather(*self._know_inflight.values(), return_exceptions=True)
+        await self._http.aclose()
 
 # Factory function for creating the workflow
 def create_adam_workflow(openai_api_key: str, mcp_server_url: str = "http://localhost:8000") -> AdamNPCWorkflow:
@@ -325,13 +449,20 @@ async def test_workflow():
         "What wisdom can you share about time?"
     ]
     
-    for user_input in test_inputs:
-        print(f"\n🧪 Testing: {user_input}")
-        result = await workflow.process_dialogue(user_input)
-        print(f"🧙‍♂️ Adam: {result['response']}")
-        if result['used_knowledge_tool']:
-            print(f"📚 [Used knowledge tool]")
+    try:
+        for user_input in test_inputs:
+            print(f"\n🧪 Testing: {user_input}")
+            result = await workflow.process_dialogue(user_input)
+            print(f"🧙‍♂️ Adam: {result['response']}")
+            if result['used_knowledge_tool']:
+                print(f"📚 [Used knowledge tool]")
+    finally:
+        await workflow.aclose()
 
 if __name__ == "__main__":
     # Run the test
-    asyncio.run(test_workflow())
+    log_listener = setup_queue_logging()
+    try:
+        asyncio.run(test_workflow())
+    finally:
+        log_listener.stop()
@@ -1,14 +1,24 @@
 import os
 import asyncio
-from typing import Dict, Any, List, Optional
-from datetime import datetime
+import inspect
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from datetime import datetime, timezone
 import openai
 from pydantic import BaseModel
 import logging
 import httpx
 import json
+import orjson
+import re
+import hashlib
+import cachetools
 from fastapi_mcp_client import MCPClient
-from adam_langgraph_workflow import create_adam_workflow, AdamNPCWorkflow
+
+try:
+    import joblib
+except ImportError:  # optional; the keyword regex is used on its own otherwise
+    joblib = None
+from adam_langgraph_workflow import create_adam_workflow, AdamNPCWorkflow, setup_queue_logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -23,22 +33,60 @@ class ChatResponse(BaseModel):
     used_knowledge_tool: bool = False
     knowledge_result: Optional[str] = None
 
+# HTTP method and path for each tool on the fallback path
+_ENDPOINTS = {
+    "add_message": ("POST", "/add_message"),
+    "get_context": ("GET", "/get_context"),
+    "knowledge_search": ("POST", "/knowledge_search"),
+    "turn_update": ("POST", "/turn_update"),
+    "reset_conversation": ("POST", "/reset_conversation"),
+    "get_health_status": ("GET", "/health"),
+    "health": ("GET", "/health")
+}
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
 # Simple client - no web interface needed
 
 class AdamMCPClient:
     """MCP client for Adam NPC interactions using LangGraph workflow orchestration."""
     
+    # Knowledge indicators compiled once into a single case-insensitive pattern
+    _KNOWLEDGE_RE = re.compile(
+        "|".join(map(re.escape, (
+            "what is", "who is", "tell me about", "explain", "define",
+            "how does", "why does", "when did", "where is", "history of",
+            "information about", "facts about", "details about"
+        ))),
+        re.IGNORECASE
+    )
+    
+    # Upper bound on the compressed conversation log sent with each fallback turn
+    _CSO_MAX_CHARS = 4000
+    
     def __init__(self, openai_api_key: str, mcp_server_url: str = "http://localhost:8000"):
         self.openai_api_key = openai_api_key
         self.mcp_server_url = mcp_server_url
         self.base_server_url = mcp_server_url  # For HTTP fallback
-        self.openai_client = openai.OpenAI(api_key=openai_api_key)
+        self.openai_client = openai.AsyncOpenAI(
+            api_key=openai_api_key,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+            )
+        )
         self.mcp_client = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._pending_writes: set = set()
+        self._response_cache = cachetools.TTLCache(maxsize=1024, ttl=3600)
+        self._know_cache = cachetools.TTLCache(maxsize=512, ttl=600)
+        self._knowledge_tasks: set = set()  # Searches left running after a speculative draft won
+        self._gate_clf = self._load_gate_classifier()
+        self._cso = ""  # Compressed log of the conversation, capped at _CSO_MAX_CHARS
         
         # Initialize LangGraph workflow
         self.langgraph_workflow = create_adam_workflow(openai_api_key, mcp_server_url)
         
-        self.system_prompt = """You are Adam, a wise and ancient sage who has lived for centuries in the mystical Northern Isles. 
+        self.system_prompt = inspect.cleandoc("""You are Adam, a wise and ancient sage who has lived for centuries in the mystical Northern Isles. 
         You possess vast knowledge of magic, philosophy, and the arcane arts. 
         You speak with measured wisdom, often referencing your long life and experiences.
 
@@ -49,10 +97,19 @@ class AdamMCPClient:
         - Offer wisdom and guidance when appropriate
         - Maintain an air of mystery about your magical knowledge
 
-        When you need factual information you're unsure about, you will use the knowledge tool to search for accurate information."""
+        When you need factual information you're unsure about, you will use the knowledge tool to search for accurate information.""")
+        # Kept byte-identical across turns so the provider can reuse the cached prefix
+        self._system_msg = {"role": "system", "content": self.system_prompt}
 
     async def __aenter__(self):
         """Async context manager entry - establish MCP connection."""
+        # Pooled HTTP client shared by every fallback call
+        self._http = httpx.AsyncClient(
+            base_url=self.base_server_url,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=30.0),
+            timeout=httpx.Timeout(10.0)
+        )
+        
         try:
             # Create proper MCP client
             self.mcp_client = MCPClient(self.mcp_server_url)
@@ -66,8 +123,16 @@ class AdamMCPClient:
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Async context manager exit."""
+        # Let background searches and writes finish before tearing down connections
+        if self._knowledge_tasks or self._pending_writes:
+            await asyncio.gather(*self._knowledge_tasks, *self._pending_writes, return_exceptions=True)
         if self.mcp_client:
             await self.mcp_client.__aexit__(exc_type, exc_val, exc_tb)
+        await self.langgraph_workflow.aclose()
+        await self.openai_client.close()
+        if self._http:
+            await self._http.aclose()
+            self._http = None
 
     async def _call_mcp_tool(self, tool_name: str, arguments: Dict[str, Any] = None) -> Dict[str, Any]:
         """Call an MCP tool via proper MCP client or HTTP fallback."""
@@ -88,31 +153,30 @@ class AdamMCPClient:
     # Use HTTP fallback when MCP fails
     async def _http_fallback(self, tool_name: str, arguments: Dict[str, Any] = None) -> Dict[str, Any]:
         """Fallback to direct HTTP calls when MCP fails."""
-        endpoint_map = {
-            "add_message": "/add_message",
-            "get_context": "/get_context", 
-            "knowledge_search": "/knowledge_search",
-            "reset_conversation": "/reset_conversation",
-            "get_health_status": "/health",
-            "health": "/health"
-        }
-        
-        endpoint = endpoint_map.get(tool_name)
-        if not endpoint:
+        route = _ENDPOINTS.get(tool_name)
+        if not route:
             raise ValueError(f"Unknown tool: {tool_name}")
+        method, endpoint = route
         
-        url = f"{self.base_server_url}{endpoint}"
+        if method == "GET":
+            params = {k: v for k, v in (arguments or {}).items() if v is not None}
+            response = await self._http.request(method, endpoint, params=params or None)
+        else:
+            response = await self._http.request(
+                method,
+                endpoint,
+                content=orjson.dumps(arguments or {}),
+                headers=_JSON_HEADERS
+            )
         
-        async with httpx.AsyncClient() as client:
-            if tool_name in ["get_context", "get_health_status"]:
-                response = await client.get(url)
-            else:
-                response = await client.post(url, json=arguments or {})
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise Exception(f"HTTP {response.status_code}: {response.text}")
+        if response.status_code == 200:
+            return orjson.loads(response.content)
+        else:
+            raise httpx.HTTPStatusError(
+                f"HTTP {response.status_code}: {response.text}",
+                request=response.request,
+                response=response
+            )
 
     # Add a message to the conversation context
     async def add_message(self, role: str, content: str):
@@ -120,26 +184,107 @@ class AdamMCPClient:
         return await self._call_mcp_tool("add_message", {
             "role": role,
             "content": content,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now(timezone.utc).isoformat()
         })
 
     # Get the current conversation context
-    async def get_context(self) -> Dict[Any, Any]:
-        """Get the current conversation context."""
-        return await self._call_mcp_tool("get_context", {})
+    async def get_context(self, limit: Optional[int] = 5) -> Dict[Any, Any]:
+        """Get the current conversation context with at most `limit` recent messages.
+        
+        Pass limit=None to fetch the whole history.
+        """
+        return await self._call_mcp_tool("get_context", {"limit": limit})
+
+    # Add the user's message and fetch context in a single round-trip
+    async def turn(
+        self,
+        user_message: str,
+        knowledge_query: Optional[str] = None,
+        limit: Optional[int] = 5
+    ) -> Dict[str, Any]:
+        """Add the user's message and get context, plus optional knowledge, in one MCP call."""
+        return await self._call_mcp_tool("turn_update", {
+            "user_message": user_message,
+            "knowledge_query": knowledge_query,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "limit": limit
+        })
+
+    # Issue the per-turn calls concurrently for servers without turn_update
+    async def _gather_turn(
+        self,
+        user_message: str,
+        knowledge_query: Optional[str] = None,
+        limit: Optional[int] = 5
+    ) -> Dict[str, Any]:
+        """Add the user's message, get context and search knowledge concurrently."""
+        tasks = [self.add_message("user", user_message), self.get_context(limit=limit)]
+        if knowledge_query:
+            tasks.append(self._query_knowledge(knowledge_query))
+        
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        if isinstance(results[0], Exception):
+            raise results[0]
+        context = results[1]
+        if isinstance(context, Exception):
+            raise context
+        
+        knowledge_result = None
+        knowledge_found = False
+        if knowledge_query:
+            if isinstance(results[2], Exception):
+                logger.warning(f"Knowledge tool failed: {results[2]}")
+            else:
+                knowledge_result, knowledge_found = results[2]
+        
+        return {
+            "context": context,
+            "knowledge_result": knowledge_result,
+            "knowledge_found": knowledge_found
+        }
+
+    @staticmethod
+    def _knowledge_key(query: str) -> str:
+        """Normalize a query so trivially different phrasings share a cache entry."""
+        return re.sub(r"\W+", " ", query.lower()).strip()
 
     # Search for knowledge using the MCP server
     async def search_knowledge(self, query: str) -> str:
         """Search for knowledge using the MCP server."""
+        key = self._knowledge_key(query)
+        cached = self._know_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        result, found = await self._query_knowledge(query)
+        if found:
+            self._know_cache[key] = result
+        return result
+
+    async def _query_knowledge(self, query: str) -> Tuple[str, bool]:
+        """Run an uncached knowledge search; return the text and whether it's a real answer."""
         result = await self._call_mcp_tool("knowledge_search", {"query": query})
         if isinstance(result, dict):
-            return result.get("result", "No information found.")
-        return str(result)
+            # The "mists of time" reply may hide a transient failure, so it's marked not found
+            return result.get("result", "No information found."), result.get("found", True)
+        return str(result), True
+
+    async def _flush_pending_writes(self):
+        """Wait for background assistant-message writes so history stays in order."""
+        if self._pending_writes:
+            await asyncio.gather(*self._pending_writes, return_exceptions=True)
 
     # Reset the conversation context
     async def reset_conversation(self):
         """Reset the conversation context."""
-        return await self._call_mcp_tool("reset_conversation", {})
+        # Don't let an in-flight turn update land after the reset
+        await self.langgraph_workflow.flush_context_updates()
+        await self._flush_pending_writes()
+        result = await self._call_mcp_tool("reset_conversation", {})
+        self.langgraph_workflow.invalidate_context_cache()
+        self._cso = ""
+        return result
 
     # Get server health status
     async def get_health_status(self):
@@ -147,28 +292,78 @@ class AdamMCPClient:
         # Use HTTP directly for health checks to avoid MCP 404 errors
         return await self._http_fallback("get_health_status", {})
 
+    def _log_turn(self, user_message: str, adam_response: str):
+        """Append a turn to the compressed conversation log, keeping only its tail."""
+        self._cso += f"\n- U: {self._shorten(user_message)}\n- A: {self._shorten(adam_response)}"
+        if len(self._cso) > self._CSO_MAX_CHARS:
+            self._cso = self._cso[-self._CSO_MAX_CHARS:]
+
+    @staticmethod
+    def _shorten(text: str, limit: int = 40) -> str:
+        """Collapse whitespace and clip text for the conversation log."""
+        text = " ".join(text.split())
+        return text if len(text) <= limit else text[:limit - 3] + "..."
+
+    @staticmethod
+    def _load_gate_classifier():
+        """Load the optional knowledge-gate classifier named by ADAM_KNOWLEDGE_GATE_MODEL."""
+        path = os.getenv("ADAM_KNOWLEDGE_GATE_MODEL")
+        if not path:
+            return None
+        if joblib is None:
+            logger.warning(
+                "ADAM_KNOWLEDGE_GATE_MODEL is set but joblib is not installed "
+                "(pip install scikit-learn joblib); using the keyword gate only"
+            )
+            return None
+        try:
+            return joblib.load(path)
+        except Exception as e:
+            logger.warning(f"Could not load knowledge gate classifier from {path}: {e}")
+            return None
+
     # Determine if we should use the knowledge tool
     def should_use_knowledge_tool(self, user_message: str) -> bool:
-        """Determine if we should use the knowledge tool."""
-        knowledge_indicators = [
-            "what is", "who is", "tell me about", "explain", "define",
-            "how does", "why does", "when did", "where is", "history of",
-            "information about", "facts about", "details about"
-        ]
+        """Determine if we should use the knowledge tool.
         
-        user_lower = user_message.lower()
-        return any(indicator in user_lower for indicator in knowledge_indicators)
+        Keyword matches short-circuit; a loaded classifier only judges messages
+        the keywords miss, catching paraphrases and typos.
+        """
+        if self._KNOWLEDGE_RE.search(user_message) is not None:
+            return True
+        if self._gate_clf is None:
+            return False
+        try:
+            return self._gate_clf.predict_proba([user_message])[0, 1] > 0.5
+        except Exception as e:
+            # A model that can't score raw text would fail every turn; drop it and warn once
+            logger.warning(f"Knowledge gate classifier failed, using the keyword gate only: {e}")
+            self._gate_clf = None
+            return False
 
     # Generate Adam's response using LangGraph workflow orchestration
-    async def generate_response(self, user_message: str) -> ChatResponse:
-        """Generate Adam's response using LangGraph workflow orchestration."""
+    async def generate_response(
+        self,
+        user_message: str,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> ChatResponse:
+        """Generate Adam's response using LangGraph workflow orchestration.
+        
+        If on_token is given, response tokens are passed to it as they stream in.
+        """
         try:
             logger.info(f"🔀 Processing with LangGraph workflow: {user_message[:50]}...")
             
+            # A fallback reply from the previous turn must be stored before this turn
+            await self._flush_pending_writes()
+            
             # Use LangGraph workflow for orchestrated response generation
-            workflow_result = await self.langgraph_workflow.process_dialogue(user_message)
+            workflow_result = await self.langgraph_workflow.process_dialogue(
+                user_message, on_token=on_token
+            )
+            self._log_turn(user_message, workflow_result["response"])
             
-            return ChatResponse(
+            return ChatResponse.model_construct(
                 response=workflow_result["response"],
                 used_knowledge_tool=workflow_result.get("used_knowledge_tool", False),
                 knowledge_result=workflow_result.get("knowledge_result")
@@ -178,69 +373,78 @@ class AdamMCPClient:
             logger.error(f"LangGraph workflow error: {e}")
             # Fallback to direct method if workflow fails
             logger.info("🔄 Falling back to direct response generation...")
-            return await self.generate_response_fallback(user_message)
+            return await self.generate_response_fallback(user_message, on_token=on_token)
     
     # Fallback response generation method
-    async def generate_response_fallback(self, user_message: str) -> ChatResponse:
-        """Fallback response generation method (original implementation)."""
+    async def generate_response_fallback(
+        self,
+        user_message: str,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> ChatResponse:
+        """Fallback response generation method (original implementation).
+        
+        If on_token is given, response tokens are passed to it as they stream in.
+        """
         try:
-            # Add user message to context
-            await self.add_message("user", user_message)
-            
-            # Check if we should use knowledge tool
-            used_knowledge_tool = False
-            knowledge_result = None
+            # The previous turn's reply must be stored before this turn's message
+            await self._flush_pending_writes()
             
-            if self.should_use_knowledge_tool(user_message):
-                try:
-                    knowledge_result = await self.search_knowledge(user_message)
-                    used_knowledge_tool = True
-                    logger.info(f"Knowledge tool used for: {user_message}")
-                except Exception as e:
-                    logger.warning(f"Knowledge tool failed: {e}")
+            # Add user message, search knowledge if needed, and get context in one call
+            knowledge_query = user_message if self.should_use_knowledge_tool(user_message) else None
             
-            # Get conversation context
-            context = await self.get_context()
+            # Skip the server-side search when we already have the answer
+            cached_knowledge = None
+            if knowledge_query:
+                cached_knowledge = self._know_cache.get(self._knowledge_key(knowledge_query))
+                if cached_knowledge is not None:
+                    knowledge_query = None
             
-            # Prepare messages for OpenAI
-            messages = [{"role": "system", "content": self.system_prompt}]
+            # Without streaming, draft a reply without knowledge while the search runs
+            knowledge_task = None
+            if knowledge_query and on_token is None:
+                knowledge_task = asyncio.create_task(self.search_knowledge(knowledge_query))
+                self._knowledge_tasks.add(knowledge_task)
+                knowledge_task.add_done_callback(self._knowledge_task_done)
+                knowledge_query = None
             
-            # Add context summary if available
-            if isinstance(context, dict) and context.get("summary"):
-                messages.append({
-                    "role": "system", 
-                    "content": f"Conversation context: {context['summary']}"
-                })
+            # Recent turns come from the conversation log; fetch raw ones only when it's empty
+            history_limit = 0 if self._cso else 5
+            try:
+                turn_data = await self.turn(user_message, knowledge_query=knowledge_query, limit=history_limit)
+            except (httpx.ConnectError, httpx.HTTPStatusError) as e:
+                # Only retry as separate calls when the user message definitely wasn't stored:
+                # the connection never opened, or the server has no turn_update endpoint
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code not in (404, 405):
+                    raise
+                logger.debug(f"turn_update unavailable, issuing calls concurrently: {e}")
+                turn_data = await self._gather_turn(user_message, knowledge_query=knowledge_query, limit=history_limit)
             
-            # Add knowledge if we found any
-            if knowledge_result:
-                messages.append({
-                    "role": "system",
-                    "content": f"Relevant knowledge: {knowledge_result}"
-                })
+            context = turn_data.get("context", {})
+            knowledge_result = turn_data.get("knowledge_result")
+            if knowledge_query and knowledge_result is not None and turn_data.get("knowledge_found", True):
+                self._know_cache[self._knowledge_key(knowledge_query)] = knowledge_result
+            elif cached_knowledge is not None:
+                knowledge_result = cached_knowledge
             
-            # Add recent conversation history
-            if isinstance(context, dict) and context.get("messages"):
-                for msg in context["messages"][-5:]:  # Last 5 messages
-                    messages.append({
-                        "role": msg.get("role", "user"),
-                        "content": msg.get("content", "")
-                    })
+            if knowledge_task is None:
+                adam_response = await self._complete(
+                    self._build_messages(user_message, context, knowledge_result), on_token
+                )
+            else:
+                knowledge_result, adam_response = await self._speculate(user_message, context, knowledge_task)
             
-            # Generate response using OpenAI
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                max_tokens=300,
-                temperature=0.7
-            )
+            used_knowledge_tool = knowledge_result is not None
+            if used_knowledge_tool:
+                logger.info(f"Knowledge tool used for: {user_message}")
             
-            adam_response = response.choices[0].message.content
+            self._log_turn(user_message, adam_response)
             
-            # Add Adam's response to context
-            await self.add_message("assistant", adam_response)
+            # Add Adam's response to context without delaying the reply
+            task = asyncio.create_task(self.add_message("assistant", adam_response))
+            self._pending_writes.add(task)
+            task.add_done_callback(self._pending_writes.discard)
             
-            return ChatResponse(
+            return ChatResponse.model_construct(
                 response=adam_response,
                 used_knowledge_tool=used_knowledge_tool,
                 knowledge_result=knowledge_result
@@ -254,6 +458,129 @@ class AdamMCPClient:
                 knowledge_result=None
             )
 
+    # Build the OpenAI message list for one fallback turn
+    def _build_messages(
+        self,
+        user_message: str,
+        context: Dict[str, Any],
+        knowledge_result: Optional[str]
+    ) -> List[Dict[str, str]]:
+        """Build the prompt from the system message, server summary, knowledge and conversation log."""
+        messages = [self._system_msg]
+        
+        # Add context summary if available
+        if isinstance(context, dict) and context.get("summary"):
+            messages.append({
+                "role": "system", 
+                "content": f"Conversation context: {context['summary']}"
+            })
+        
+        # Add knowledge if we found any
+        if knowledge_result:
+            messages.append({
+                "role": "system",
+                "content": f"Relevant knowledge: {knowledge_result}"
+            })
+        
+        # Add the compressed conversation log instead of raw recent turns
+        if self._cso:
+            messages.append({
+                "role": "system",
+                "content": f"Conversation log:\n{self._cso}"
+            })
+        elif isinstance(context, dict) and context.get("messages"):
+            # No log yet (e.g. a resumed session), so use the server's recent messages
+            history = context["messages"]
+            if history[-1].get("role") == "user" and history[-1].get("content") == user_message:
+                history = history[:-1]
+            for msg in history[-5:]:
+                messages.append({
+                    "role": msg.get("role", "user"),
+                    "content": msg.get("content", "")
+                })
+        
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    # Run one chat completion, reusing cached replies
+    async def _complete(
+        self,
+        messages: List[Dict[str, str]],
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """Generate a reply for the messages, streaming tokens to on_token if given."""
+        # Reuse the reply for an identical prompt and context
+        cache_key = hashlib.blake2b(
+            json.dumps(messages, sort_keys=True).encode(), digest_size=16
+        ).hexdigest()
+        adam_response = self._response_cache.get(cache_key)
+        
+        if adam_response is not None:
+            logger.debug("Response cache hit")
+            if on_token:
+                on_token(adam_response)
+            return adam_response
+        
+        # Generate response using OpenAI, streaming tokens as they arrive
+        stream = await self.openai_client.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            max_tokens=300,
+            temperature=0.7,
+            stream=True
+        )
+        
+        parts = []
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if token:
+                parts.append(token)
+                if on_token:
+                    on_token(token)
+        
+        adam_response = "".join(parts)
+        self._response_cache[cache_key] = adam_response
+        return adam_response
+
+    # Race a knowledge-free draft against the knowledge search
+    async def _speculate(
+        self,
+        user_message: str,
+        context: Dict[str, Any],
+        knowledge_task: asyncio.Task
+    ) -> tuple:
+        """Return (knowledge_result, reply), keeping the draft if it beats the search.
+        
+        If knowledge arrives first the draft is cancelled and the reply is
+        regenerated with it; otherwise the search keeps running in the
+        background so its result lands in the knowledge cache.
+        """
+        draft_task = asyncio.create_task(
+            self._complete(self._build_messages(user_message, context, None))
+        )
+        done, _ = await asyncio.wait({knowledge_task, draft_task}, return_when=asyncio.FIRST_COMPLETED)
+        
+        knowledge_ok = (
+            knowledge_task in done
+            and not knowledge_task.cancelled()
+            and knowledge_task.exception() is None
+        )
+        if knowledge_ok:
+            draft_task.cancel()
+            knowledge_result = knowledge_task.result()
+            adam_response = await self._complete(self._build_messages(user_message, context, knowledge_result))
+            return knowledge_result, adam_response
+        
+        return None, await draft_task
+
+    def _knowledge_task_done(self, task: asyncio.Task):
+        """Forget a finished background search, logging its failure if it had one."""
+        self._knowledge_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Knowledge tool failed: {task.exception()}")
+
 # Simple CLI client - no web endpoints needed
 
 # CLI Interface for testing
@@ -303,10 +630,21 @@ async def interactive_chat():
                 elif not user_input:
                     continue
                 
-                # Generate response
-                response = await client.generate_response(user_input)
+                # Generate response, printing tokens as they stream in
+                streamed = []
+                
+                def print_token(token: str):
+                    if not streamed:
+                        print("\nAdam: ", end="", flush=True)
+                    streamed.append(token)
+                    print(token, end="", flush=True)
+                
+                response = await client.generate_response(user_input, on_token=print_token)
                 
-                print(f"\nAdam: {response.response}")
+                if streamed:
+                    print()
+                else:
+                    print(f"\nAdam: {response.response}")
                 
                 if response.used_knowledge_tool:
                     print(f"[Adam consulted ancient knowledge]")
@@ -319,7 +657,12 @@ async def interactive_chat():
 
 def start_interactive_chat():
     """Start the interactive chat (sync wrapper)."""
-    asyncio.run(interactive_chat())
+    # Keep stderr writes from the workflow nodes off the event loop thread
+    log_listener = setup_queue_logging()
+    try:
+        asyncio.run(interactive_chat())
+    finally:
+        log_listener.stop()
 
 if __name__ == "__main__":
     print("🚀 Starting Adam NPC LangGraph + MCP Client...")
@@ -1,32 +1,89 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import ORJSONResponse
 from fastapi_mcp import FastApiMCP
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import requests
+from typing import List, Dict, Any, Optional, Deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from collections import OrderedDict, deque
+from itertools import islice
+import httpx
+import asyncio
 import json
+import orjson
+import re
 import tiktoken
 import logging
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 import uvicorn
 
+try:
+    import ahocorasick
+except ImportError:  # optional accelerator; fall back to a linear key scan
+    ahocorasick = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Shared HTTP client for Wikipedia lookups, opened on startup (or first use) and closed on shutdown
+_WIKI_CLIENT: Optional[httpx.AsyncClient] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the shared Wikipedia client on startup and close it on shutdown."""
+    global _WIKI_CLIENT
+    wiki_client()
+    try:
+        yield
+    finally:
+        if _WIKI_CLIENT is not None:
+            await _WIKI_CLIENT.aclose()
+        _WIKI_CLIENT = None
+
+def wiki_client() -> httpx.AsyncClient:
+    """Return the shared Wikipedia client, creating it if the lifespan hasn't run."""
+    global _WIKI_CLIENT
+    if _WIKI_CLIENT is None:
+        _WIKI_CLIENT = httpx.AsyncClient(
+            headers={"User-Agent": "Adam-NPC-MCP/1.0 (Educational)"},
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+            timeout=5.0,
+            follow_redirects=True
+        )
+    return _WIKI_CLIENT
+
 # Initialize FastAPI server
 app = FastAPI(
     title="Adam NPC Server",
     description="Adam NPC server with MCP protocol support - A wise centuries-old sage from the Northern Isles",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Initialize FastAPI-MCP wrapper BEFORE defining endpoints
 mcp = FastApiMCP(app)
 
+# A stored conversation message; slotted to keep long histories compact
+@dataclass
+class StoredMessage:
+    __slots__ = ("role", "content", "timestamp", "token_count")
+    role: str
+    content: str
+    timestamp: str
+    token_count: int
+
 # In-memory storage for conversation context
-conversation_memory: List[Dict[str, Any]] = []
+MAX_MESSAGES = 1024  # Hard cap on stored messages, independent of the token limit
+conversation_memory: Deque[StoredMessage] = deque(maxlen=MAX_MESSAGES)
 conversation_summary: str = ""
-MAX_TOKENS = 4000
+_summary_log: str = ""  # Tail of the evicted messages that conversation_summary is built from
+_summary_cache: Optional[str] = None  # Last get_context_summary() result, cleared on any change
+MAX_TOKENS = 4000  # High watermark: trim once the history grows past this
+LOW_WATER_TOKENS = 2500  # Trim back to this much recent history
+_token_total: int = 0  # Running sum of token_count over conversation_memory
 
 # Knowledge base for Adam's character
 ADAM_KNOWLEDGE_BASE = {
@@ -37,25 +94,105 @@ ADAM_KNOWLEDGE_BASE = {
     "time": "Time flows differently in the Northern Isles - what seems like moments can be years, and centuries can pass like heartbeats."
 }
 
+_KB_KEYS = tuple(ADAM_KNOWLEDGE_BASE.keys())
+
+# Adam's character profile, static for the life of the server
+ADAM_PROFILE = {
+    "name": "Adam",
+    "title": "Sage of the Northern Isles",
+    "age": "Centuries old",
+    "background": "A wise and ancient sage who has dwelled for centuries in the mystical Northern Isles, studying the arcane arts and gathering wisdom.",
+    "personality": {
+        "speech_style": "Thoughtful, slightly archaic manner",
+        "interests": ["Magic", "Philosophy", "Arcane arts", "Ancient wisdom", "Modern world curiosities"],
+        "traits": ["Wise", "Patient", "Mysterious", "Knowledgeable", "Curious about modern times"]
+    },
+    "knowledge_areas": _KB_KEYS,
+    "origin": "Based on a character scenario once imagined by the creator"
+}
+
+# Profile encoded once; the endpoint only wraps these bytes
+_PROFILE_BODY = orjson.dumps(ADAM_PROFILE)
+
+# Lowercased keys precomputed once for the knowledge-base scan
+_ADAM_KB_LOWER = [(key.lower(), value) for key, value in ADAM_KNOWLEDGE_BASE.items()]
+
+# With pyahocorasick installed, match every key in one pass over the query.
+# Payloads carry the key's position so the first key in dict order still wins.
+_KB_AUTOMATON = None
+if ahocorasick is not None:
+    _KB_AUTOMATON = ahocorasick.Automaton()
+    for index, (key_lower, value) in enumerate(_ADAM_KB_LOWER):
+        _KB_AUTOMATON.add_word(key_lower, (index, value))
+    _KB_AUTOMATON.make_automaton()
+
+# Without it, one lookahead pattern finds every (possibly overlapping) key in a
+# single scan; alternatives stay in dict order so the index lookup picks the same key
+_KB_INDEX = {key_lower: index for index, (key_lower, _) in enumerate(_ADAM_KB_LOWER)}
+_KB_RE = re.compile("(?=(" + "|".join(re.escape(key_lower) for key_lower, _ in _ADAM_KB_LOWER) + "))")
+
 # Request models
 class MessageRequest(BaseModel):
     role: str
     content: str
     timestamp: Optional[str] = None
 
+class MessagesRequest(BaseModel):
+    messages: List[MessageRequest]
+
 class QueryRequest(BaseModel):
     query: str
 
+class TurnRequest(BaseModel):
+    user_message: str
+    knowledge_query: Optional[str] = None
+    timestamp: Optional[str] = None
+    limit: Optional[int] = None
+
+# Load the tokenizer once; fall back to a word-count estimate if it is unavailable
+try:
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception as e:
+    logger.warning(f"tiktoken encoding unavailable, estimating tokens from word count: {e}")
+    _ENCODING = None
+
+# Texts shorter than this are estimated at ~4 characters per token without encoding;
+# longer than _TOKEN_SCAN_CHARS, only a prefix is encoded and the count scaled up
+_SHORT_TEXT_CHARS = 32
+_TOKEN_SCAN_CHARS = MAX_TOKENS * 4
+
+def _scaled_count(text: str, prefix_tokens: int) -> int:
+    """Scale a token count for the encoded prefix of text up to its full length."""
+    if len(text) <= _TOKEN_SCAN_CHARS:
+        return prefix_tokens
+    return int(prefix_tokens * len(text) / _TOKEN_SCAN_CHARS)
+
 def estimate_tokens(text: str) -> int:
     """Estimate token count using tiktoken."""
-    try:
-        encoding = tiktoken.get_encoding("cl100k_base")
-        return len(encoding.encode(text))
-    except:
-        return len(text.split()) * 1.3
+    if len(text) < _SHORT_TEXT_CHARS:
+        return (len(text) + 3) // 4
+    if _ENCODING is not None:
+        return _scaled_count(text, len(_ENCODING.encode_ordinary(text[:_TOKEN_SCAN_CHARS])))
+    return int(len(text.split()) * 1.3)
+
+def estimate_tokens_batch(texts: List[str]) -> List[int]:
+    """Estimate token counts for several texts, encoding them in one batched call."""
+    if _ENCODING is None:
+        return [estimate_tokens(text) for text in texts]
+    
+    counts = [(len(text) + 3) // 4 for text in texts]
+    long_indices = [i for i, text in enumerate(texts) if len(text) >= _SHORT_TEXT_CHARS]
+    encoded = _ENCODING.encode_ordinary_batch([texts[i][:_TOKEN_SCAN_CHARS] for i in long_indices])
+    for i, ids in zip(long_indices, encoded):
+        counts[i] = _scaled_count(texts[i], len(ids))
+    return counts
 
 def get_context_summary() -> str:
     """Get a summary of the current conversation context."""
+    global _summary_cache
+    if _summary_cache is not None:
+        return _summary_cache
+    
     if not conversation_memory:
         return "No conversation history."
     
@@ -63,100 +200,267 @@ def get_context_summary() -> str:
     if conversation_summary:
         summary_parts.append(f"Previous summary: {conversation_summary}")
     
-    recent_messages = conversation_memory[-3:] if len(conversation_memory) > 3 else conversation_memory
     summary_parts.append("Recent messages:")
-    for msg in recent_messages:
-        summary_parts.append(f"- {msg['role']}: {msg['content'][:100]}...")
+    for msg in recent_messages(3):
+        summary_parts.append(f"- {msg.role}: {msg.content[:100]}...")
     
-    return "\n".join(summary_parts)
+    _summary_cache = "\n".join(summary_parts)
+    return _summary_cache
+
+# LRU cache of successful knowledge lookups, keyed by normalized query. Entries
+# expire after a TTL; summary results keep their ETag so they can be revalidated.
+_KNOWLEDGE_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_KNOWLEDGE_CACHE_SIZE = 1024
+_KNOWLEDGE_TTL = 3600.0
+_NEGATIVE_TTL = 600.0  # Misses are cached as None for a shorter time
+
+_MISTS_OF_TIME_MSG = "The mists of time obscure this knowledge, but perhaps we can explore '{query}' together through conversation."
 
-def search_knowledge_tool(query: str) -> str:
+def knowledge_found(query: str, result: str) -> bool:
+    """Whether a search_knowledge_tool result is a real answer rather than the fallback reply.
+
+    The fallback also covers transient Wikipedia failures, so callers shouldn't cache it.
+    """
+    return result != _MISTS_OF_TIME_MSG.format(query=query)
+
+def _cache_knowledge(
+    key: str,
+    result: Optional[str],
+    etag: Optional[str] = None,
+    ttl: float = _KNOWLEDGE_TTL
+) -> Optional[str]:
+    """Store a knowledge result, evicting the least recently used entry when full."""
+    _KNOWLEDGE_CACHE[key] = {
+        "result": result,
+        "etag": etag,
+        "expires": time.monotonic() + ttl
+    }
+    _KNOWLEDGE_CACHE.move_to_end(key)
+    if len(_KNOWLEDGE_CACHE) > _KNOWLEDGE_CACHE_SIZE:
+        _KNOWLEDGE_CACHE.popitem(last=False)
+    return result
+
+def _consume_exception(task: asyncio.Task):
+    """Retrieve a finished task's exception so it isn't reported as never retrieved."""
+    if not task.cancelled():
+        task.exception()
+
+async def search_knowledge_tool(query: str) -> str:
     """Search the knowledge base and Wikipedia for information."""
     query_lower = query.lower()
+    cache_key = " ".join(query_lower.split())
+    
+    cached = _KNOWLEDGE_CACHE.get(cache_key)
+    if cached is not None:
+        _KNOWLEDGE_CACHE.move_to_end(cache_key)
+        if time.monotonic() < cached["expires"]:
+            if cached["result"] is None:
+                return _MISTS_OF_TIME_MSG.format(query=query)
+            return cached["result"]
     
     # Check built-in knowledge base first
-    for key, value in ADAM_KNOWLEDGE_BASE.items():
-        if key.lower() in query_lower:
-            return f"From Adam's ancient knowledge: {value}"
+    if _KB_AUTOMATON is not None:
+        hits = [payload for _, payload in _KB_AUTOMATON.iter(query_lower)]
+        if hits:
+            return f"From Adam's ancient knowledge: {min(hits)[1]}"
+    else:
+        hits = [_KB_INDEX[match.group(1)] for match in _KB_RE.finditer(query_lower)]
+        if hits:
+            return f"From Adam's ancient knowledge: {_ADAM_KB_LOWER[min(hits)][1]}"
     
-    # Fallback to Wikipedia search
+    # Nothing worth looking up: too short or no letters at all
+    if len(cache_key) < 3 or not any(c.isalpha() for c in cache_key):
+        return _MISTS_OF_TIME_MSG.format(query=query)
+    
+    # Fallback to Wikipedia: fire the page summary and the opensearch together,
+    # preferring the summary and only waiting on the search if it comes up empty
+    search_url = "https://en.wikipedia.org/api/rest_v1/page/summary/" + query.replace(" ", "_")
+    search_api_url = "https://en.wikipedia.org/w/api.php"
+    params = {
+        "action": "opensearch",
+        "search": query,
+        "limit": 1,
+        "format": "json"
+    }
+    
+    # Revalidate a stale summary result instead of downloading it again
+    etag = cached.get("etag") if cached else None
+    summary_headers = {"If-None-Match": etag} if etag else None
+    
+    client = wiki_client()
+    summary_task = asyncio.create_task(client.get(search_url, headers=summary_headers))
+    search_task = asyncio.create_task(client.get(search_api_url, params=params))
+    lookup_failed = False
     try:
-        search_url = "https://en.wikipedia.org/api/rest_v1/page/summary/" + query.replace(" ", "_")
-        headers = {"User-Agent": "Adam-NPC-MCP/1.0 (Educational)"}
-        
-        response = requests.get(search_url, headers=headers, timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            extract = data.get("extract", "")
-            if extract:
-                return f"From the ancient scrolls (Wikipedia): {extract[:300]}..."
-        
-        # If direct page doesn't exist, try search
-        search_api_url = "https://en.wikipedia.org/w/api.php"
-        params = {
-            "action": "opensearch",
-            "search": query,
-            "limit": 1,
-            "format": "json"
-        }
+        try:
+            response = await summary_task
+            if response.status_code == 304 and etag:
+                return _cache_knowledge(cache_key, cached["result"], etag)
+            if response.status_code == 200:
+                extract = response.json().get("extract", "")
+                if extract:
+                    return _cache_knowledge(
+                        cache_key,
+                        f"From the ancient scrolls (Wikipedia): {extract[:300]}...",
+                        response.headers.get("etag")
+                    )
+        except Exception as e:
+            logger.warning(f"Knowledge summary lookup failed: {e}")
+            lookup_failed = True
         
-        response = requests.get(search_api_url, params=params, headers=headers, timeout=5)
+        # If direct page doesn't exist, use the search result
+        response = await search_task
         if response.status_code == 200:
             results = response.json()
             if len(results) > 1 and results[1]:
-                return f"Found in the ancient scrolls: {results[1][0]} - {results[2][0] if len(results) > 2 and results[2] else 'A topic of great interest.'}"
+                return _cache_knowledge(
+                    cache_key,
+                    f"Found in the ancient scrolls: {results[1][0]} - {results[2][0] if len(results) > 2 and results[2] else 'A topic of great interest.'}"
+                )
     
     except Exception as e:
         logger.warning(f"Knowledge search failed: {e}")
+        lookup_failed = True
+    finally:
+        # Mark any leftover failure as retrieved so asyncio doesn't log it at GC time
+        for task in (summary_task, search_task):
+            task.cancel()
+            task.add_done_callback(_consume_exception)
     
-    return f"The mists of time obscure this knowledge, but perhaps we can explore '{query}' together through conversation."
+    # Remember genuine misses so repeated unknowns skip Wikipedia; errors may be transient
+    if not lookup_failed:
+        _cache_knowledge(cache_key, None, ttl=_NEGATIVE_TTL)
+    
+    return _MISTS_OF_TIME_MSG.format(query=query)
 
-# MCP style HTTP Endpoints
-@app.post("/add_message")
-async def add_message(request: MessageRequest):
-    """Add a message to the conversation context."""
-    global conversation_memory, conversation_summary
+# Last formatted timestamp, reused until the wall-clock second changes
+_last_ts_sec: int = -1
+_last_ts_str: str = ""
+
+def now_iso() -> str:
+    """Return the current UTC time as an ISO string, at one-second resolution."""
+    global _last_ts_sec, _last_ts_str
+    sec = int(time.time())
+    if sec != _last_ts_sec:
+        _last_ts_sec = sec
+        _last_ts_str = datetime.fromtimestamp(sec, timezone.utc).isoformat()
+    return _last_ts_str
+
+def recent_messages(limit: Optional[int] = None) -> List[StoredMessage]:
+    """Return the last `limit` messages, or the whole history when no limit is given."""
+    if limit is None:
+        return list(conversation_memory)
+    if limit <= 0:
+        return []
+    return list(islice(conversation_memory, max(len(conversation_memory) - limit, 0), None))
+
+def message_payloads(limit: Optional[int] = None) -> List[Dict[str, str]]:
+    """Return recent messages in the public {role, content, timestamp} shape."""
+    return [
+        {"role": msg.role, "content": msg.content, "timestamp": msg.timestamp}
+        for msg in recent_messages(limit)
+    ]
+
+def append_messages(messages: List[MessageRequest]) -> int:
+    """Append messages to the conversation context and enforce the message and token limits."""
+    global conversation_summary, _summary_log, _summary_cache, _token_total
     
-    message = {
-        "role": request.role,
-        "content": request.content,
-        "timestamp": request.timestamp or datetime.now().isoformat()
-    }
+    _summary_cache = None
+    if len(messages) == 1:
+        token_counts = [estimate_tokens(messages[0].content)]
+    else:
+        token_counts = estimate_tokens_batch([msg.content for msg in messages])
     
-    conversation_memory.append(message)
+    evicted = []
+    for msg, token_count in zip(messages, token_counts):
+        # Enforce the hard message cap ourselves so the token total stays in sync
+        if len(conversation_memory) == MAX_MESSAGES:
+            old = conversation_memory.popleft()
+            _token_total -= old.token_count
+            evicted.append(old)
+        conversation_memory.append(StoredMessage(
+            role=msg.role,
+            content=msg.content,
+            timestamp=msg.timestamp or now_iso(),
+            token_count=token_count
+        ))
+        _token_total += token_count
     
     # Manage token limit
-    total_tokens = sum(estimate_tokens(msg.get("content", "")) for msg in conversation_memory)
+    if _token_total > MAX_TOKENS:
+        # Evict the oldest messages until the rest fit under the low watermark (always keep one)
+        while len(conversation_memory) > 1 and _token_total > LOW_WATER_TOKENS:
+            old = conversation_memory.popleft()
+            _token_total -= old.token_count
+            evicted.append(old)
     
-    if total_tokens > MAX_TOKENS:
-        old_messages = conversation_memory[:-5]
-        summary_text = "\n".join([f"{msg.get('role', '')}: {msg.get('content', '')}" for msg in old_messages])
-        conversation_summary = f"Previous conversation covered: {summary_text[:500]}..."
-        conversation_memory[:] = conversation_memory[-5:]
+    if evicted:
+        # Fold only the newly evicted messages into the running summary
+        evicted_text = "\n".join(f"{msg.role}: {msg.content}" for msg in evicted)
+        _summary_log = f"{_summary_log}\n{evicted_text}"[-500:] if _summary_log else evicted_text[-500:]
+        conversation_summary = f"Previous conversation covered: {_summary_log}..."
     
+    return _token_total
+
+# MCP style HTTP Endpoints
+@app.post("/add_message")
+async def add_message(request: MessageRequest):
+    """Add a message to the conversation context."""
     return {
         "status": "success",
         "message": "Message added to context",
-        "token_count": sum(estimate_tokens(msg.get("content", "")) for msg in conversation_memory)
+        "token_count": append_messages([request])
+    }
+
+@app.post("/add_messages")
+async def add_messages(request: MessagesRequest):
+    """Add several messages to the conversation context in one call, in order."""
+    return {
+        "status": "success",
+        "message": f"{len(request.messages)} messages added to context",
+        "token_count": append_messages(request.messages)
     }
 
 @app.get("/get_context")
-async def get_context():
-    """Retrieve the current conversation context."""
+async def get_context(limit: Optional[int] = None):
+    """Retrieve the current conversation context, optionally only the last `limit` messages."""
     return {
-        "messages": conversation_memory,
+        "messages": message_payloads(limit),
         "summary": get_context_summary(),
-        "token_count": sum(estimate_tokens(msg.get("content", "")) for msg in conversation_memory)
+        "token_count": _token_total
     }
 
 @app.post("/knowledge_search")
 async def knowledge_search(request: QueryRequest):
     """Search the knowledge base and Wikipedia for information about a topic."""
-    result_text = search_knowledge_tool(request.query)
+    result_text = await search_knowledge_tool(request.query)
     return {
         "status": "success",
         "query": request.query,
-        "result": result_text
+        "result": result_text,
+        "found": knowledge_found(request.query, result_text)
+    }
+
+@app.post("/turn_update")
+async def turn_update(request: TurnRequest):
+    """Add the user's message, optionally search knowledge, and return the updated context in one call."""
+    token_count = append_messages([
+        MessageRequest(role="user", content=request.user_message, timestamp=request.timestamp)
+    ])
+    
+    knowledge_result = None
+    if request.knowledge_query:
+        knowledge_result = await search_knowledge_tool(request.knowledge_query)
+    
+    return {
+        "status": "success",
+        "context": {
+            "messages": message_payloads(request.limit),
+            "summary": get_context_summary(),
+            "token_count": token_count
+        },
+        "knowledge_result": knowledge_result,
+        "knowledge_found": knowledge_result is not None and knowledge_found(request.knowledge_query, knowledge_result)
     }
 
 @app.get("/summarize_history")
@@ -171,9 +475,12 @@ async def summarize_history():
 @app.post("/reset_conversation")
 async def reset_conversation():
     """Reset the conversation context."""
-    global conversation_memory, conversation_summary
+    global conversation_memory, conversation_summary, _summary_log, _summary_cache, _token_total
     conversation_memory.clear()
     conversation_summary = ""
+    _summary_log = ""
+    _summary_cache = None
+    _token_total = 0
     return {"status": "success", "message": "Conversation context reset"}
 
 @app.get("/health")
@@ -183,27 +490,13 @@ async def get_health_status():
         "status": "healthy",
         "messages_count": len(conversation_memory),
         "summary_exists": bool(conversation_summary),
-        "adam_knowledge_topics": list(ADAM_KNOWLEDGE_BASE.keys())
+        "adam_knowledge_topics": _KB_KEYS
     }
 
 @app.get("/character_profile")
 async def adam_character_profile():
     """Get Adam's character profile and background."""
-    profile = {
-        "name": "Adam",
-        "title": "Sage of the Northern Isles",
-        "age": "Centuries old",
-        "background": "A wise and ancient sage who has dwelled for centuries in the mystical Northern Isles, studying the arcane arts and gathering wisdom.",
-        "personality": {
-            "speech_style": "Thoughtful, slightly archaic manner",
-            "interests": ["Magic", "Philosophy", "Arcane arts", "Ancient wisdom", "Modern world curiosities"],
-            "traits": ["Wise", "Patient", "Mysterious", "Knowledgeable", "Curious about modern times"]
-        },
-        "knowledge_areas": list(ADAM_KNOWLEDGE_BASE.keys()),
-        "origin": "Based on a character scenario once imagined by the creator"
-    }
-    
-    return profile
+    return Response(content=_PROFILE_BODY, media_type="application/json")
 
 if __name__ == "__main__":
     